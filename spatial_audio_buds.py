@@ -1,17 +1,28 @@
-import asyncio
+import argparse
+import functools
+import glob
+import math
 
 import sounddevice as sd
 import numpy as np
-import pyquaternion as pq
 import slab
 import soundfile as sf
 import threading
-import queue
 import time
 import os
-import struct
-import bluetooth
 import socket
+from scipy.fft import irfft, rfft
+from scipy.signal import resample_poly
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Stand-in for numba.njit that leaves the decorated function as plain Python."""
+        return lambda func: func
 
 # --- Configuration Parameters ---
 # Path to your HRTF SOFA file.
@@ -34,31 +45,85 @@ CHANNELS = 2
 DTYPE = 'float32'
 
 # --- Global State Variables ---
-head_orientation_queue = queue.Queue(maxsize=10)
-current_head_orientation = pq.Quaternion()
+# Single-slot reference to the latest unit (w, x, y, z) head orientation. The tracking thread
+# replaces the tuple and the audio callback reads it; both are atomic reference operations.
+latest_head_orientation = [(1.0, 0.0, 0.0, 0.0)]
+head_orientation_received = threading.Event()
 hrtf = None
-audio_file = None
+hrir_table = None
+# Uniform-partitioned overlap-save convolution state: the last two input blocks and the
+# frequency-domain delay line of their spectra, newest partition first.
+conv_input = None
+conv_fdl = None
+# Scratch buffers for the per-block spectral multiply-accumulate
+conv_product = None
+conv_spectrum = None
+current_hrir_bin = None
+# Last orientation seen by the audio callback and the HRIR bin computed from it
+cached_head_orientation = None
+cached_hrir_bin = None
+# Whole music file, decoded, mixed down to mono and resampled to SAMPLERATE at startup
+audio_data = None
+playback_pos = 0
 stop_event = threading.Event()
 
 
+RAD_TO_DEG = 180.0 / math.pi
+
+# Linear crossfade applied over one block when the HRIR bin changes
+CROSSFADE_IN = ((np.arange(BLOCKSIZE) + 0.5) / BLOCKSIZE).astype(np.float32)
+CROSSFADE_OUT = 1.0 - CROSSFADE_IN
+
 # --- Helper Functions ---
 
-def crc16(data: bytes):
+@njit(cache=True)
+def crc16_nb(data):
     """
-    Calculates the CRC16-CCITT (XMODEM) checksum.
+    Calculates the CRC16-CCITT (XMODEM) checksum of a uint8 array in native code.
+    The per-bit loop is unrolled and branchless: the polynomial is masked in by the MSB.
     """
-    crc = 0x0000
-    polynomial = 0x1021
-    for byte in data:
-        crc ^= (byte << 8)
-        for _ in range(8):
-            if crc & 0x8000:
-                crc = (crc << 1) ^ polynomial
-            else:
-                crc = crc << 1
+    crc = 0
+    for i in range(data.shape[0]):
+        crc ^= np.int64(data[i]) << 8
+        crc = ((crc << 1) ^ (0x1021 & -((crc >> 15) & 1))) & 0xFFFF
+        crc = ((crc << 1) ^ (0x1021 & -((crc >> 15) & 1))) & 0xFFFF
+        crc = ((crc << 1) ^ (0x1021 & -((crc >> 15) & 1))) & 0xFFFF
+        crc = ((crc << 1) ^ (0x1021 & -((crc >> 15) & 1))) & 0xFFFF
+        crc = ((crc << 1) ^ (0x1021 & -((crc >> 15) & 1))) & 0xFFFF
+        crc = ((crc << 1) ^ (0x1021 & -((crc >> 15) & 1))) & 0xFFFF
+        crc = ((crc << 1) ^ (0x1021 & -((crc >> 15) & 1))) & 0xFFFF
+        crc = ((crc << 1) ^ (0x1021 & -((crc >> 15) & 1))) & 0xFFFF
+    return crc
+
+
+def _crc16_table_entry(byte):
+    """Computes the CRC16-CCITT remainder of a single byte for the lookup table."""
+    crc = byte << 8
+    for _ in range(8):
+        if crc & 0x8000:
+            crc = (crc << 1) ^ 0x1021
+        else:
+            crc = crc << 1
     return crc & 0xFFFF
 
 
+_CRC16_TABLE = [_crc16_table_entry(i) for i in range(256)]
+
+
+def crc16(data):
+    """
+    Calculates the CRC16-CCITT (XMODEM) checksum with a 256-entry lookup table.
+    Pure-Python fallback for crc16_nb when Numba is not installed.
+    """
+    crc = 0x0000
+    for byte in bytes(data):
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16_TABLE[((crc >> 8) ^ byte) & 0xFF]
+    return crc
+
+
+_packet_crc16 = crc16_nb if NUMBA_AVAILABLE else crc16
+
+
 def load_hrtf(file_path):
     """Loads HRTF data from a SOFA file."""
     print(f"Loading HRTF from: {file_path}...")
@@ -71,20 +136,111 @@ def load_hrtf(file_path):
         return None
 
 
+def build_hrir_table(loaded_hrtf, file_path):
+    """
+    Returns interpolated HRIRs on a 1-degree (azimuth, elevation) grid.
+    The table is indexed as [azimuth % 360, elevation + 90, ear, tap] so the
+    audio callback only needs an array lookup instead of a SOFA interpolation.
+    Taps are stored as float16 to halve the table size; they are upcast when spectra are computed.
+    HRIRs measured at a different samplerate are resampled to SAMPLERATE.
+    The table is cached next to the SOFA file, keyed on its modification time, tap count and
+    SAMPLERATE, so the interpolation only runs the first time an HRTF file is used.
+    """
+    try:
+        hrtf_samplerate = int(round(loaded_hrtf.samplerate))
+        divisor = math.gcd(hrtf_samplerate, SAMPLERATE)
+        up, down = SAMPLERATE // divisor, hrtf_samplerate // divisor
+
+        def interpolate_taps(azimuth, elevation):
+            taps = loaded_hrtf.interpolate(azimuth, elevation).data[:, :2].T
+            if up != down:
+                # Scale by fs_in / fs_out so the resampled impulse response keeps its gain.
+                taps = resample_poly(taps, up, down, axis=-1) * (down / up)
+            return taps
+
+        taps = interpolate_taps(0, 0).shape[-1]
+        # The "v2" suffix invalidates tables cached before resampled taps were gain-corrected.
+        cache_path = (f"{os.path.splitext(file_path)[0]}.hrir_v2_{os.stat(file_path).st_mtime_ns}"
+                      f"_{taps}_{SAMPLERATE}.npy")
+        if os.path.exists(cache_path):
+            try:
+                table = np.load(cache_path)
+                if table.shape == (360, 181, 2, taps) and table.dtype == np.float16:
+                    print(f"Loaded HRIR lookup table from {cache_path}.")
+                    return table
+            except (OSError, ValueError) as e:
+                print(f"Warning: could not read cached HRIR lookup table ({e}), rebuilding it.")
+
+        print("Precomputing HRIR lookup table (first run for this HRTF file, this may take a while)...")
+        if hrtf_samplerate != SAMPLERATE:
+            print(f"Resampling HRIRs from {hrtf_samplerate} Hz to {SAMPLERATE} Hz...")
+        table = np.empty((360, 181, 2, taps), dtype=np.float16)
+        for azimuth in range(-180, 180):
+            for elevation in range(-90, 91):
+                table[azimuth % 360, elevation + 90] = interpolate_taps(azimuth, elevation)
+        print(f"HRIR lookup table ready: {table.shape[0]}x{table.shape[1]} bins, {taps} taps.")
+
+        # Write to a temporary file first so an interrupted save never leaves a truncated cache.
+        try:
+            with open(cache_path + ".tmp", "wb") as cache_file:
+                np.save(cache_file, table)
+            os.replace(cache_path + ".tmp", cache_path)
+            print(f"Saved HRIR lookup table to {cache_path}.")
+            # Tables cached for older versions of this SOFA file are never read again.
+            for stale_path in glob.glob(f"{glob.escape(os.path.splitext(file_path)[0])}.hrir_*.npy"):
+                if stale_path != cache_path:
+                    try:
+                        os.remove(stale_path)
+                    except OSError as e:
+                        print(f"Warning: could not remove stale HRIR lookup table {stale_path}: {e}")
+        except OSError as e:
+            print(f"Warning: could not save HRIR lookup table: {e}")
+        return table
+    except Exception as e:
+        print(f"Error precomputing HRIR lookup table: {e}")
+        return None
+
+
+@functools.lru_cache(maxsize=512)
+def hrir_spectra(az_i, el_i):
+    """
+    Returns the partitioned spectra of the HRIR in a lookup table bin, shaped
+    (ears, partitions, BLOCKSIZE + 1). Each BLOCKSIZE-tap partition is zero-padded
+    to 2 * BLOCKSIZE for overlap-save.
+    """
+    taps = hrir_table[az_i, el_i].astype(np.float32)
+    partitions = -(-taps.shape[-1] // BLOCKSIZE)
+    padded = np.zeros((taps.shape[0], partitions * BLOCKSIZE), dtype=np.float32)
+    padded[:, :taps.shape[-1]] = taps
+    return rfft(padded.reshape(taps.shape[0], partitions, BLOCKSIZE), n=2 * BLOCKSIZE, axis=-1)
+
+
 def load_audio_file(file_path):
-    """Loads an audio file for playback."""
+    """
+    Loads an audio file into memory as mono float32 PCM, resampled to the stream samplerate.
+    """
     print(f"Loading audio file: {file_path}...")
     try:
-        loaded_audio = sf.SoundFile(file_path, 'r')
-        print(f"Audio file loaded. Sample rate: {loaded_audio.samplerate}, Channels: {loaded_audio.channels}")
-        return loaded_audio
+        data, file_samplerate = sf.read(file_path, dtype=DTYPE, always_2d=True)
+        print(f"Audio file loaded. Sample rate: {file_samplerate}, Channels: {data.shape[1]}")
+        mono = data.mean(axis=1)
+        if file_samplerate != SAMPLERATE:
+            print(f"Resampling audio from {file_samplerate} Hz to {SAMPLERATE} Hz...")
+            divisor = math.gcd(file_samplerate, SAMPLERATE)
+            mono = resample_poly(mono, SAMPLERATE // divisor, file_samplerate // divisor)
+        return np.ascontiguousarray(mono, dtype=DTYPE)
     except Exception as e:
         print(f"Error loading audio file: {e}")
         return None
 
 
 def discover_and_list_bluetooth_devices():
-    """Scans for nearby Bluetooth devices and lists their RFCOMM services."""
+    """
+    Scans for nearby Bluetooth devices and lists their RFCOMM services.
+    PyBluez is imported here because only this optional diagnostic needs it.
+    """
+    import bluetooth
+
     print("\n--- Discovering Bluetooth Devices (This may take a moment)... ---")
     nearby_devices = bluetooth.discover_devices(duration=8, lookup_names=True, flush_cache=True, lookup_class=False)
     if not nearby_devices:
@@ -107,7 +263,7 @@ def discover_and_list_bluetooth_devices():
     print("------------------------------------------------------------------\n")
 
 
-# --- Real Head Tracking with PyBluez ---
+# --- Real Head Tracking over RFCOMM ---
 
 def send_enable_spatial_audio_command(sock):
     """
@@ -118,119 +274,143 @@ def send_enable_spatial_audio_command(sock):
     try:
         sock.send(command)
         print(f"Sent enable spatial audio command: {command.hex()}")
-    except bluetooth.BluetoothError as e:
+    except OSError as e:
         print(f"Failed to send enable command: {e}")
     except Exception as e:
         print(f"Unexpected error sending command: {e}")
 
 
-def parse_galaxy_buds_head_tracking_data(data_bytes):
+@njit(cache=True)
+def _is_valid_spatial_payload_nb(packet):
     """
-    Parses raw byte data from Galaxy Buds according to the reversed protocol.
-    Expected format: [0xFE] [0x27] [Payload Len LSB] [Payload Len MSB] [0xA8] [QuatX] [QuatY] [QuatZ] [QuatW] [CRC16 LSB] [CRC16 MSB]
+    Checks the payload length, sub-message ID and CRC16 of a 23-byte spatial data packet.
     """
-    # Packet has a fixed total length of 23 bytes for spatial data
-    EXPECTED_FULL_PACKET_LENGTH = 23
-    HEADER_CRC_LEN = 6  # Preamble(1) + MsgID(1) + PayloadLen(2) + CRC(2)
-    SUB_MSG_ID = 0xA8
-    SPATIAL_MSG_ID = 0x27
-    PREAMBLE = 0xFE
-
-    if len(data_bytes) != EXPECTED_FULL_PACKET_LENGTH:
-        return None
-
-    if data_bytes[0] != PREAMBLE:
-        return None
+    payload_length = np.int64(packet[2]) | (np.int64(packet[3]) << 8)
+    if payload_length != 17:  # SubMsgID(1) + Quaternion(16)
+        return False
+    if packet[4] != 0xA8:
+        return False
+    received_crc = np.int64(packet[21]) | (np.int64(packet[22]) << 8)
+    return received_crc == _packet_crc16(packet[:21])
 
-    message_id = data_bytes[1]
-    if message_id != SPATIAL_MSG_ID:
-        print(
-            f"Received valid preamble ({PREAMBLE:02X}), but unexpected Message ID: {message_id:02X}. Raw: {data_bytes.hex()}")
-        return None
-
-    try:
-        payload_length = struct.unpack('<H', data_bytes[2:4])[0]
-        if payload_length != 17:  # SubMsgID(1) + Quaternion(16)
-            return None
 
-        sub_msg_id = data_bytes[4]
-        if sub_msg_id != SUB_MSG_ID:
-            return None
+@njit(cache=True)
+def validate_packets_nb(packets):
+    """
+    Validates a batch of 23-byte spatial data packets, one per row, and returns a boolean mask.
+    """
+    valid = np.zeros(packets.shape[0], dtype=np.bool_)
+    for k in range(packets.shape[0]):
+        packet = packets[k]
+        valid[k] = packet[0] == 0xFE and packet[1] == 0x27 and _is_valid_spatial_payload_nb(packet)
+    return valid
 
-        quaternion_raw_bytes = data_bytes[5:21]
-        x, y, z, w = struct.unpack('<ffff', quaternion_raw_bytes)
 
-        received_crc = struct.unpack('<H', data_bytes[21:23])[0]
-        calculated_crc = crc16(data_bytes[:21])
+def parse_galaxy_buds_head_tracking_batch(packets):
+    """
+    Parses a batch of raw packets from Galaxy Buds according to the reversed protocol.
+    Expected format: [0xFE] [0x27] [Payload Len LSB] [Payload Len MSB] [0xA8] [QuatX] [QuatY] [QuatZ] [QuatW] [CRC16 LSB] [CRC16 MSB]
+    Takes a (packets, 23) uint8 array and returns the orientation of the newest valid packet as a
+    (w, x, y, z) tuple, or None if no packet in the batch is valid.
+    """
+    SPATIAL_MSG_ID = 0x27
+    PREAMBLE = 0xFE
 
-        if received_crc != calculated_crc:
-            return None
+    for k in np.flatnonzero((packets[:, 0] == PREAMBLE) & (packets[:, 1] != SPATIAL_MSG_ID)):
+        print(
+            f"Received valid preamble ({PREAMBLE:02X}), but unexpected Message ID: {packets[k, 1]:02X}. Raw: {packets[k].tobytes().hex()}")
 
-        return pq.Quaternion(w=w, x=x, y=y, z=z)
-    except (struct.error, IndexError):
+    valid_indices = np.flatnonzero(validate_packets_nb(packets))
+    if valid_indices.shape[0] == 0:
         return None
 
+    # Only the newest orientation is used, so only that one is decoded.
+    x, y, z, w = packets[valid_indices[-1], 5:21].copy().view('<f4')
+    return float(w), float(x), float(y), float(z)
+
 
-def galaxy_buds_head_tracking_thread(mac_address, rfcomm_port, data_queue, stop_event):
+def galaxy_buds_head_tracking_thread(mac_address, rfcomm_port, orientation_slot, orientation_received, stop_event):
     """
-    Connects to Galaxy Buds via PyBluez RFCOMM and continuously reads head tracking data.
+    Connects to Galaxy Buds over a native RFCOMM socket and continuously reads head tracking data.
     """
     print(f"Attempting to connect to Galaxy Buds at {mac_address} on RFCOMM port {rfcomm_port}...")
-    sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+    sock = None
     try:
+        if not hasattr(socket, "AF_BLUETOOTH"):
+            print("Error: this Python interpreter was built without Bluetooth socket support (socket.AF_BLUETOOTH).")
+            return
+        sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
         sock.connect((mac_address, rfcomm_port))
         print("Connected to Galaxy Buds. Sending enable command...")
         send_enable_spatial_audio_command(sock)
         sock.settimeout(0.1)
 
-        recv_buffer = bytearray()
+        # Fixed ring buffer filled in place by recv_into; head/tail are absolute byte counts.
+        RING_SIZE = 4096
+        ring = np.empty(RING_SIZE, dtype=np.uint8)
+        ring_view = memoryview(ring)
+        head = tail = 0
         EXPECTED_FULL_PACKET_LENGTH = 23
+        PREAMBLE = 0xFE
+        skipped_bytes = 0
+
+        # Aligned packets are staged here and validated together.
+        BATCH_SIZE = 16
+        batch = np.empty((BATCH_SIZE, EXPECTED_FULL_PACKET_LENGTH), dtype=np.uint8)
 
         print("Starting head tracking data reception loop.")
         while not stop_event.is_set():
             try:
-                data_chunk = sock.recv(256)
-                if data_chunk:
-                    recv_buffer.extend(data_chunk)
-                    while len(recv_buffer) >= EXPECTED_FULL_PACKET_LENGTH:
-                        preamble_index = recv_buffer.find(b'\xFE')
-                        if preamble_index == -1:
-                            recv_buffer.clear()
-                            break
-
-                        if preamble_index > 0:
-                            print(
-                                f"Skipping {preamble_index} invalid byte(s) before preamble: {recv_buffer[:preamble_index].hex()}...")
-                            del recv_buffer[:preamble_index]
-                            if len(recv_buffer) < EXPECTED_FULL_PACKET_LENGTH:
-                                break
-
-                        packet = recv_buffer[:EXPECTED_FULL_PACKET_LENGTH]
-                        quaternion = parse_galaxy_buds_head_tracking_data(packet)
-                        if quaternion:
-                            try:
-                                if not data_queue.full():
-                                    data_queue.put_nowait(quaternion)
-                                else:
-                                    data_queue.get_nowait()
-                                    data_queue.put_nowait(quaternion)
-                            except queue.Full:
-                                pass
-
-                        del recv_buffer[:EXPECTED_FULL_PACKET_LENGTH]
-            except bluetooth.BluetoothError as e:
+                tail_pos = tail % RING_SIZE
+                write_len = min(256, RING_SIZE - tail_pos, RING_SIZE - (tail - head))
+                received = sock.recv_into(ring_view[tail_pos:tail_pos + write_len])
+                if received == 0:
+                    print("Galaxy Buds closed the connection.")
+                    stop_event.set()
+                    break
+
+                tail += received
+                while tail - head >= EXPECTED_FULL_PACKET_LENGTH:
+                    batch_count = 0
+                    while batch_count < BATCH_SIZE and tail - head >= EXPECTED_FULL_PACKET_LENGTH:
+                        head_pos = head % RING_SIZE
+                        # Resync one byte at a time; while in sync this is a single compare.
+                        if ring[head_pos] != PREAMBLE:
+                            head += 1
+                            skipped_bytes += 1
+                            continue
+
+                        if skipped_bytes:
+                            print(f"Skipped {skipped_bytes} invalid byte(s) before preamble.")
+                            skipped_bytes = 0
+
+                        first = min(EXPECTED_FULL_PACKET_LENGTH, RING_SIZE - head_pos)
+                        batch[batch_count, :first] = ring[head_pos:head_pos + first]
+                        batch[batch_count, first:] = ring[:EXPECTED_FULL_PACKET_LENGTH - first]
+                        batch_count += 1
+                        head += EXPECTED_FULL_PACKET_LENGTH
+
+                    if batch_count == 0:
+                        continue
+                    quaternion = parse_galaxy_buds_head_tracking_batch(batch[:batch_count])
+                    if quaternion:
+                        w, x, y, z = quaternion
+                        norm = (w * w + x * x + y * y + z * z) ** 0.5
+                        if norm > 1e-6:
+                            orientation_slot[0] = (w / norm, x / norm, y / norm, z / norm)
+                            if not orientation_received.is_set():
+                                orientation_received.set()
+            except socket.timeout:
+                pass
+            except OSError as e:
                 print(f"Bluetooth error during data reception: {e}")
                 stop_event.set()
                 break
-            except socket.timeout:
-                pass
             except Exception as e:
                 print(f"Error in head tracking loop: {e}")
                 stop_event.set()
                 break
-    except bluetooth.BluetoothError as e:
-        print(f"Failed to connect to Galaxy Buds: {e}")
-    except Exception as e:
+    except OSError as e:
         if "Only one usage of each socket address" in str(e):
             print(
                 "\nCritical Error: A connection attempt failed because another application is already using this Bluetooth port.")
@@ -238,73 +418,96 @@ def galaxy_buds_head_tracking_thread(mac_address, rfcomm_port, data_queue, stop_
                 "Please ensure the official Galaxy Buds app or any other program using Bluetooth is completely closed.")
             print("You may need to restart your PC's Bluetooth service or reboot the computer to free the port.")
         else:
-            print(f"An unexpected error occurred in the head tracking thread: {e}")
+            print(f"Failed to connect to Galaxy Buds: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred in the head tracking thread: {e}")
     finally:
-        sock.close()
+        if sock is not None:
+            sock.close()
         print("Galaxy Buds head tracking connection closed.")
         stop_event.set()
 
 
 # --- Audio Processing Callback ---
 
-def audio_callback(outdata, frames, time_info, status):
+def head_orientation_to_hrir_bin(orientation):
     """
-    Sounddevice callback function for real-time audio processing.
+    Returns the (azimuth, elevation) HRIR table indices of the fixed source as seen from a
+    unit (w, x, y, z) head orientation.
     """
-    global current_head_orientation
-
-    if status:
-        print(f"Sounddevice status: {status}")
-
-    try:
-        while True:
-            current_head_orientation = head_orientation_queue.get_nowait()
-    except queue.Empty:
-        pass
+    # Rotate the fixed source vector (1, 0, 0) by the inverse (conjugate) of the unit head quaternion.
+    w, x, y, z = orientation
+    rx = 1.0 - 2.0 * (y * y + z * z)
+    ry = 2.0 * (x * y - z * w)
+    rz = 2.0 * (x * z + y * w)
 
-    chunk = audio_file.read(frames, dtype=DTYPE)
-    if len(chunk) < frames:
-        chunk = np.pad(chunk, ((0, frames - len(chunk)), (0, 0))) if chunk.ndim > 1 else np.pad(chunk, (
-        0, frames - len(chunk)))
-        if len(chunk) == 0:
-            print("End of audio file or no more data, stopping stream.")
-            raise sd.CallbackStop
+    azimuth_deg = math.atan2(ry, rx) * RAD_TO_DEG
 
-    if chunk.ndim > 1:
-        mono_chunk = chunk.mean(axis=1)
-    else:
-        mono_chunk = chunk
+    horizontal_distance = math.sqrt(rx * rx + ry * ry)
+    elevation_deg = math.atan2(rz, horizontal_distance if horizontal_distance > 1e-6 else 1e-6) * RAD_TO_DEG
 
-    fixed_source_vector = np.array([1.0, 0.0, 0.0])
+    azimuth_deg = math.fmod(azimuth_deg + 540.0, 360.0) - 180.0
 
-    inverse_head_q = current_head_orientation.inverse
-    rotated_source_vector = inverse_head_q.rotate(fixed_source_vector)
+    az_i = int(round(azimuth_deg)) % 360
+    el_i = int(round(elevation_deg)) + 90
+    return az_i, el_i
 
-    azimuth_rad = np.arctan2(rotated_source_vector[1], rotated_source_vector[0])
-    azimuth_deg = np.degrees(azimuth_rad)
 
-    horizontal_distance = np.sqrt(rotated_source_vector[0] ** 2 + rotated_source_vector[1] ** 2)
-    elevation_rad = np.arctan2(rotated_source_vector[2], horizontal_distance if horizontal_distance > 1e-6 else 1e-6)
-    elevation_deg = np.degrees(elevation_rad)
+def partitioned_convolve(spectra):
+    """
+    Multiplies the frequency-domain delay line by the given HRIR partition spectra and returns
+    the valid half of the overlap-save output, shaped (ears, BLOCKSIZE).
+    """
+    np.multiply(conv_fdl, spectra, out=conv_product)
+    np.sum(conv_product, axis=1, out=conv_spectrum)
+    return irfft(conv_spectrum, axis=-1, overwrite_x=True)[:, BLOCKSIZE:]
 
-    if azimuth_deg > 180:
-        azimuth_deg -= 360
-    elif azimuth_deg < -180:
-        azimuth_deg += 360
 
-    try:
-        interpolated_hrir = hrtf.interpolate(azimuth_deg, elevation_deg)
-        spatialized_audio = interpolated_hrir.apply(mono_chunk, samplerate=SAMPLERATE)
+def audio_callback(outdata, frames, time_info, status):
+    """
+    Sounddevice callback function for real-time audio processing.
+    """
+    global current_hrir_bin, cached_head_orientation, cached_hrir_bin, playback_pos
 
-        if spatialized_audio.ndim == 1:
-            spatialized_audio = np.stack((spatialized_audio, spatialized_audio), axis=1)
+    if status:
+        print(f"Sounddevice status: {status}")
 
-        if spatialized_audio.shape[0] < frames:
-            spatialized_audio = np.pad(spatialized_audio, ((0, frames - spatialized_audio.shape[0]), (0, 0)))
-        elif spatialized_audio.shape[0] > frames:
-            spatialized_audio = spatialized_audio[:frames, :]
+    available = min(frames, audio_data.shape[0] - playback_pos)
+    if available <= 0:
+        print("End of audio file or no more data, stopping stream.")
+        outdata.fill(0)
+        raise sd.CallbackStop
+
+    # Copy the next block straight into the overlap-save input buffer;
+    # the end of the file is zero-filled in place.
+    conv_input[:BLOCKSIZE] = conv_input[BLOCKSIZE:]
+    mono_chunk = conv_input[BLOCKSIZE:]
+    mono_chunk[:available] = audio_data[playback_pos:playback_pos + available]
+    mono_chunk[available:] = 0
+    playback_pos += available
+
+    # The HRIR bin only changes when a new orientation is published, which is slower than the block rate.
+    orientation = latest_head_orientation[0]
+    if orientation is not cached_head_orientation:
+        cached_hrir_bin = head_orientation_to_hrir_bin(orientation)
+        cached_head_orientation = orientation
+    hrir_bin = cached_hrir_bin
 
-        outdata[:] = spatialized_audio
+    try:
+        # Shift the spectrum of the new input into the frequency-domain delay line.
+        conv_fdl[1:] = conv_fdl[:-1]
+        conv_fdl[0] = rfft(conv_input)
+
+        spectra = hrir_spectra(*hrir_bin)
+        spatialized = partitioned_convolve(spectra)
+        if current_hrir_bin is not None and hrir_bin != current_hrir_bin:
+            # Crossfade from the previous HRIR to avoid clicks when the bin changes.
+            previous_spectra = hrir_spectra(*current_hrir_bin)
+            previous = partitioned_convolve(previous_spectra)
+            spatialized = previous * CROSSFADE_OUT + spatialized * CROSSFADE_IN
+        current_hrir_bin = hrir_bin
+
+        outdata[:] = spatialized.T
     except Exception as e:
         print(f"Error during HRTF application: {e}")
         outdata.fill(0)
@@ -312,11 +515,13 @@ def audio_callback(outdata, frames, time_info, status):
 
 # --- Main Application Logic ---
 
-async def main():
+def main(discover_devices=False):
     """
     Main function to set up the spatial audio system.
+    Bluetooth device discovery is diagnostic only and runs when discover_devices is set.
     """
-    global hrtf, audio_file, current_head_orientation
+    global hrtf, hrir_table, conv_input, conv_fdl, conv_product, conv_spectrum, current_hrir_bin
+    global cached_head_orientation, cached_hrir_bin, audio_data, playback_pos
 
     if not os.path.exists(HRTF_SOFA_FILE):
         print(f"Error: HRTF file not found at {HRTF_SOFA_FILE}. Please update the path.")
@@ -324,39 +529,48 @@ async def main():
     hrtf = load_hrtf(HRTF_SOFA_FILE)
     if hrtf is None:
         return
+    hrir_table = build_hrir_table(hrtf, HRTF_SOFA_FILE)
+    if hrir_table is None:
+        return
+    hrir_spectra.cache_clear()
+    conv_input = np.zeros(2 * BLOCKSIZE, dtype=np.float32)
+    partitions = -(-hrir_table.shape[-1] // BLOCKSIZE)
+    conv_fdl = np.zeros((partitions, BLOCKSIZE + 1), dtype=np.complex64)
+    conv_product = np.empty((hrir_table.shape[2], partitions, BLOCKSIZE + 1), dtype=np.complex64)
+    conv_spectrum = np.empty((hrir_table.shape[2], BLOCKSIZE + 1), dtype=np.complex64)
+    current_hrir_bin = None
+    cached_head_orientation = cached_hrir_bin = None
 
     if not os.path.exists(MUSIC_FILE_PATH):
         print(f"Error: Music file not found at {MUSIC_FILE_PATH}. Please update the path.")
         return
-    audio_file = load_audio_file(MUSIC_FILE_PATH)
-    if audio_file is None:
+    audio_data = load_audio_file(MUSIC_FILE_PATH)
+    if audio_data is None:
         return
+    playback_pos = 0
 
-    if audio_file.samplerate != SAMPLERATE:
-        print(
-            f"Warning: Audio file samplerate ({audio_file.samplerate}) does not match stream samplerate ({SAMPLERATE}). Consider resampling the audio file.")
-
-    current_head_orientation = pq.Quaternion()
+    latest_head_orientation[0] = (1.0, 0.0, 0.0, 0.0)
+    head_orientation_received.clear()
 
-    discover_and_list_bluetooth_devices()
+    if discover_devices:
+        discover_and_list_bluetooth_devices()
 
     head_tracking_thread = threading.Thread(
         target=galaxy_buds_head_tracking_thread,
-        args=(GALAXY_BUDS_MAC_ADDRESS, GALAXY_BUDS_RFCOMM_PORT, head_orientation_queue, stop_event)
+        args=(GALAXY_BUDS_MAC_ADDRESS, GALAXY_BUDS_RFCOMM_PORT, latest_head_orientation, head_orientation_received,
+              stop_event)
     )
     head_tracking_thread.daemon = True
     head_tracking_thread.start()
 
     print("Waiting for head tracking connection and initial data...")
     start_wait_time = time.time()
-    while not stop_event.is_set() and (time.time() - start_wait_time < 15) and head_orientation_queue.empty():
-        time.sleep(0.5)
+    while not stop_event.is_set() and (time.time() - start_wait_time < 15) and not head_orientation_received.is_set():
+        head_orientation_received.wait(0.5)
 
-    if not head_tracking_thread.is_alive() or head_orientation_queue.empty():
+    if not head_tracking_thread.is_alive() or not head_orientation_received.is_set():
         print("Head tracking connection failed or no valid data received within timeout. Exiting.")
         stop_event.set()
-        if audio_file:
-            audio_file.close()
         return
 
     print("Starting audio stream...")
@@ -379,14 +593,16 @@ async def main():
         stop_event.set()
         if head_tracking_thread.is_alive():
             head_tracking_thread.join(timeout=5)
-        if audio_file:
-            audio_file.close()
         print("Application stopped.")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spatial audio playback with Galaxy Buds head tracking.")
+    parser.add_argument("--discover", action="store_true",
+                        help="scan for nearby Bluetooth devices and list their RFCOMM services before starting")
+    args = parser.parse_args()
     try:
-        asyncio.run(main())
+        main(discover_devices=args.discover)
     except KeyboardInterrupt:
         print("\nUser interrupted, stopping.")
         stop_event.set()